@@ -42,6 +42,18 @@ manage_datadog.py dashboards put /tmp/dash_5663.json
 Create a dashboard like 5663
 edit /tmp/dash_5663.json. Change id to 0.
 manage_datadog.py dashboards put /tmp/dash_5663.json
+
+COMPACT EXPORTS
+Both get subcommands take --format (json, ndjson or msgpack) and --compress
+(none, gzip or zstd).  ndjson writes one object per line and msgpack writes a
+stream of maps.  get writes each object as it is fetched.  put parses the
+file one object at a time but reads all of it before updating datadog, so a
+truncated file is rejected rather than partly applied.  put detects the compression and format from the file header, so no options
+are needed to load an export back in:
+manage_datadog.py dashboards get --format msgpack --compress zstd > /tmp/dashes.mp.zst
+manage_datadog.py dashboards put /tmp/dashes.mp.zst
+
+msgpack needs the 'msgpack' package and zstd needs the 'zstandard' package.
 """
 
 import re
@@ -50,12 +62,328 @@ import sys
 import os
 import yaml
 import json
+import zlib
+import gzip
+import struct
 import ConfigParser
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from dogapi import dog_http_api as api
 
 import pdb
 
+CHUNK_SIZE = 64 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+FORMATS = ['json', 'ndjson', 'msgpack']
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+
+
+class Passthrough(object):
+    """
+    Stand in for a compressor object when no compression is used.
+    """
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def get_compressor(compress):
+    """
+    Returns an object with compress() and flush() methods for the
+    compression named by 'compress'.
+    """
+    if compress == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compress == 'zstd':
+        if zstandard is None:
+            raise Exception('zstd compression needs the zstandard package!!!!')
+        return zstandard.ZstdCompressor().compressobj()
+    return Passthrough()
+
+
+def read_chunks(fp, compress):
+    """
+    Yields the decompressed contents of the binary file object 'fp' one
+    chunk at a time.  Every gzip member and zstd frame is read, and input
+    that ends part way through one raises.
+    """
+    if compress == 'gzip':
+        # GzipFile reads concatenated members and checks each CRC.
+        gz = gzip.GzipFile(fileobj=fp, mode='rb')
+        try:
+            for chunk in iter(lambda: gz.read(CHUNK_SIZE), b''):
+                yield chunk
+        except (IOError, EOFError, struct.error, zlib.error) as e:
+            raise Exception('gzip input is truncated or corrupt (%s)!!!!' % e)
+    elif compress == 'zstd':
+        if zstandard is None:
+            raise Exception('zstd compression needs the zstandard package!!!!')
+        dctx = zstandard.ZstdDecompressor()
+        decompressor = dctx.decompressobj()
+        try:
+            for piece in split_zstd_frames(
+                    iter(lambda: fp.read(CHUNK_SIZE), b'')):
+                # A decompressobj only handles one frame.
+                if piece is None:
+                    decompressor = dctx.decompressobj()
+                else:
+                    yield decompressor.decompress(piece)
+        except zstandard.ZstdError as e:
+            raise Exception('zstd input is corrupt (%s)!!!!' % e)
+    else:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            yield chunk
+
+
+def split_zstd_frames(chunks):
+    """
+    Yields the compressed zstd stream in 'chunks' a piece at a time, with
+    None after the end of each frame.  zstandard 0.14 (the last release for
+    python 2) cannot say where a frame ends, so the frame and block headers
+    are walked here.  Skippable frames are dropped.  Raises if the stream
+    ends part way through a frame.
+    """
+    # state is the header being read or 'payload'/'skip' for bytes passed
+    # through or dropped.  need is how many bytes it takes.  steps are the
+    # (state, need) pairs that follow the current payload.
+    state, need, steps = 'magic', 4, []
+    header = b''
+    checksum = False
+    for chunk in chunks:
+        while chunk:
+            if state in ('payload', 'skip'):
+                piece, chunk = chunk[:need], chunk[need:]
+                need -= len(piece)
+                if state == 'payload':
+                    yield piece
+            else:
+                take = need - len(header)
+                header, chunk = header + chunk[:take], chunk[take:]
+                if len(header) < need:
+                    continue
+                fields = bytearray(header)
+                if state == 'magic':
+                    if header == ZSTD_MAGIC:
+                        yield header
+                        state, need = 'descriptor', 1
+                    elif header[1:] == b'\x2a\x4d\x18' and \
+                            fields[0] & 0xf0 == 0x50:
+                        state, need = 'skip_size', 4
+                    else:
+                        raise Exception('zstd input is corrupt '
+                            '(bad frame magic)!!!!')
+                elif state == 'skip_size':
+                    state, need = 'skip', struct.unpack('<I', header)[0]
+                    steps = [('magic', 4)]
+                elif state == 'descriptor':
+                    yield header
+                    single_segment = fields[0] & 0x20
+                    checksum = bool(fields[0] & 0x04)
+                    rest = (0 if single_segment else 1) + \
+                        [0, 1, 2, 4][fields[0] & 0x03] + \
+                        [1 if single_segment else 0, 2, 4, 8][fields[0] >> 6]
+                    state, need, steps = 'payload', rest, [('block', 3)]
+                else:
+                    yield header
+                    block = fields[0] | fields[1] << 8 | fields[2] << 16
+                    block_type = (block >> 1) & 0x03
+                    if block_type == 3:
+                        raise Exception('zstd input is corrupt '
+                            '(reserved block type)!!!!')
+                    state = 'payload'
+                    need = 1 if block_type == 1 else block >> 3
+                    if not block & 0x01:
+                        steps = [('block', 3)]
+                    elif checksum:
+                        steps = [('payload', 4), ('end', 0)]
+                    else:
+                        steps = [('end', 0)]
+                header = b''
+
+            while state in ('payload', 'skip') and need == 0:
+                state, need = steps.pop(0)
+                if state == 'end':
+                    yield None
+                    state, need = 'magic', 4
+
+    if state != 'magic' or header:
+        raise Exception('zstd input is truncated!!!!')
+
+
+def detect_compression(header):
+    """
+    Works out the compression of a file from its first bytes.
+    """
+    if header.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if header.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return 'none'
+
+
+def detect_format(header):
+    """
+    Works out the format of a (decompressed) file from its first bytes.
+        '{' may be a line of ndjson.  Confirm with is_ndjson().
+        A msgpack map header (fixmap, map16 or map32) is msgpack.
+        Anything else is a plain json/yaml document.
+    """
+    first = bytearray(header.lstrip()[:1])
+    if not first:
+        return 'json'
+    if first[0] == ord('{'):
+        return 'ndjson'
+    if (0x80 <= first[0] <= 0x8f) or first[0] in (0xde, 0xdf):
+        return 'msgpack'
+    return 'json'
+
+
+def is_ndjson(first_line):
+    """
+    True if 'first_line' is a complete json value.  A pretty printed json
+    object also starts with '{' but its first line does not parse.
+    """
+    try:
+        json.loads(first_line.decode('utf-8'))
+    except ValueError:
+        return False
+    return True
+
+
+def dump_records(records, out, fmt='json', compress='none'):
+    """
+    Writes each record dict in 'records' to the file object 'out' one
+    record at a time.
+    """
+    if fmt == 'msgpack' and msgpack is None:
+        raise Exception('msgpack format needs the msgpack package!!!!')
+    compressor = get_compressor(compress)
+
+    if fmt == 'json':
+        # Write the array one record at a time rather than building it.
+        sep = b'[\n'
+        for record in records:
+            out.write(compressor.compress(sep +
+                json.dumps(record, indent=4).encode('utf-8')))
+            sep = b',\n'
+        out.write(compressor.compress(b'[\n]\n' if sep == b'[\n'
+            else b'\n]\n'))
+    else:
+        for record in records:
+            if fmt == 'msgpack':
+                # use_bin_type would pack python 2 str keys ('id') as bin.
+                chunk = msgpack.packb(record, use_bin_type=False)
+            else:
+                chunk = json.dumps(record,
+                    separators=(',', ':')).encode('utf-8') + b'\n'
+            out.write(compressor.compress(chunk))
+    out.write(compressor.flush())
+    out.flush()
+
+
+def load_records(fp, loader, fmt=None, compress=None):
+    """
+    Yields record dicts read from the binary file object 'fp'.
+    Compression and format are detected from the header unless given.
+    ndjson and msgpack are read one chunk at a time.  Plain documents are
+    read whole and handed to 'loader' (ie. json.loads or yaml.load).
+    """
+    if compress is None:
+        compress = detect_compression(fp.read(len(ZSTD_MAGIC)))
+        fp.seek(0)
+    chunks = read_chunks(fp, compress)
+
+    # Read until we have something to sniff the format from.  For ndjson
+    # that is the whole first line.
+    detected = fmt is None
+    started = False
+    head = []
+    for chunk in chunks:
+        head.append(chunk)
+        if not started:
+            if not chunk.strip():
+                continue
+            started = True
+            chunk = chunk.lstrip()
+            if detected:
+                fmt = detect_format(chunk)
+        if fmt != 'ndjson' or b'\n' in chunk:
+            break
+    if fmt is None:
+        fmt = 'json'
+    elif detected and fmt == 'ndjson':
+        first_line = b''.join(head).lstrip().split(b'\n', 1)[0]
+        if not is_ndjson(first_line):
+            fmt = 'json'
+
+    def decompressed():
+        for chunk in head:
+            yield chunk
+        for chunk in chunks:
+            yield chunk
+
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise Exception('msgpack format needs the msgpack package!!!!')
+        unpacker = msgpack.Unpacker(raw=False)
+        fed = 0
+        for chunk in decompressed():
+            unpacker.feed(chunk)
+            fed += len(chunk)
+            for record in unpacker:
+                yield record
+        if unpacker.tell() != fed:
+            raise Exception('msgpack input ends part way through a record!!!!')
+    elif fmt == 'ndjson':
+        # Keep partial line pieces and only join them at a newline.
+        pieces = []
+        line_no = 0
+        for chunk in decompressed():
+            if b'\n' not in chunk:
+                pieces.append(chunk)
+                continue
+            lines = chunk.split(b'\n')
+            pieces.append(lines[0])
+            lines[0] = b''.join(pieces)
+            pieces = [lines.pop()]
+            for line in lines:
+                line_no += 1
+                if line.strip():
+                    yield parse_ndjson_line(line, line_no)
+        line = b''.join(pieces)
+        if line.strip():
+            yield parse_ndjson_line(line, line_no + 1)
+    else:
+        for record in loader(b''.join(decompressed()).decode('utf-8')):
+            yield record
+
+
+def parse_ndjson_line(line, line_no):
+    """
+    Parses one line of ndjson.  The error names the format so a file that
+    was wrongly taken for ndjson can be loaded again with --format json.
+    """
+    try:
+        return json.loads(line.decode('utf-8'))
+    except ValueError as e:
+        raise Exception('Bad ndjson record on line %d (%s).  '
+            'Try --format json!!!!' % (line_no, e))
+
+
 class DataDogObject(object):
     def __repr__(self):
         return json.dumps(self.__dict__, indent=4)
@@ -145,6 +473,12 @@ class DataDogObjectCollection(object):
     def __getitem__(self, int_key):
         return self.data[int_key]
 
+    def load_data_from_api(self, regex_str):
+        self.data.extend(self.iter_data_from_api(regex_str))
+
+    def load_data_from_file(self, file_path, fmt=None, compress=None):
+        self.data.extend(self.iter_data_from_file(file_path, fmt, compress))
+
     def get_obj(self, int_id):
         for obj in self.data:
             if obj.id == int_id:
@@ -162,17 +496,27 @@ class DataDogObjectCollection(object):
         switch[args.sub_subparser_name](args)
 
     def get(self, args):
-        self.load_data_from_api(args.regex)
+        """
+        Writes each object to stdout as it is fetched from datadog.
+        """
+        data = self.iter_data_from_api(args.regex)
 
         if args.get_id != 0:
-            data = []
-            data.append(self.get_obj(args.get_id))
-        else:
-            data = self.data
-        print data
+            obj = next((o for o in data if o.id == args.get_id), None)
+            if obj is None:
+                raise Exception('No object with id %d!!!!' % args.get_id)
+            data = [obj]
+
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        dump_records((obj.__dict__ for obj in data), out, args.format,
+            args.compress)
 
     def put(self, args):
-        self.load_data_from_file(args.from_file)
+        """
+        The whole file is parsed before datadog is touched, so a truncated
+        or corrupt file fails without being partly applied.
+        """
+        self.load_data_from_file(args.from_file, args.format, args.compress)
         self.update_datadog()
 
 
@@ -207,7 +551,7 @@ class Alerts(DataDogObjectCollection):
     """
     Collection of alerts.
     """
-    def load_data_from_api(self, regex_str):
+    def iter_data_from_api(self, regex_str):
         """
         Usese datadog method get_all_alerts to get all alerts.
         If regex_str is specified then regex is applied to 'name' field for
@@ -225,12 +569,11 @@ class Alerts(DataDogObjectCollection):
         # get list of alerts I want.
         for alert in all_alerts:
             if alerts_regex.search(alert['name']):
-                alert_obj = Alert(alert)
-                self.data.append(alert_obj)
+                yield Alert(alert)
 
-    def load_data_from_file(self, file_path):
+    def iter_data_from_file(self, file_path, fmt=None, compress=None):
         """
-        Loads all alerts listed in file 'file_path'.
+        Yields all alerts listed in file 'file_path'.
         The format of the file should be as follows:
             [
              {id: <int>,
@@ -240,12 +583,13 @@ class Alerts(DataDogObjectCollection):
              silenced: <boolean>},
              ...
             ]
+        ndjson and msgpack exports, optionally gzip or zstd compressed, are
+        also accepted.  See load_records().
         """
-        fp = open(file_path, 'r')
-        alerts_python_obj = yaml.load(fp)
+        fp = open(file_path, 'rb')
 
-        for alert_dict in alerts_python_obj:
-            self.data.append(Alert(alert_dict))
+        for alert_dict in load_records(fp, yaml.load, fmt, compress):
+            yield Alert(alert_dict)
 
     def update_datadog(self):
         """
@@ -283,7 +627,7 @@ class Dashbrd(DataDogObject):
 
 
 class Dashbrds(DataDogObjectCollection):
-    def load_data_from_api(self, regex_str):
+    def iter_data_from_api(self, regex_str):
         """
         Uses datadog method dashboards to get all dashboards.
         If regex_str is specified then regex is applied to 'title' field for
@@ -304,15 +648,13 @@ class Dashbrds(DataDogObjectCollection):
         for dash in all_dashboards:
             if dash_regex.search(dash['title']):
                 obj = self.dapi.dashboard(dash['id'])
-                dash_obj = Dashbrd(obj)
-                self.data.append(dash_obj)
+                yield Dashbrd(obj)
 
-    def load_data_from_file(self, file_path):
-        fp = open(file_path, 'r')
-        data_python_obj = json.load(fp)
+    def iter_data_from_file(self, file_path, fmt=None, compress=None):
+        fp = open(file_path, 'rb')
 
-        for data_dict in data_python_obj:
-            self.data.append(Dashbrd(data_dict))
+        for data_dict in load_records(fp, json.loads, fmt, compress):
+            yield Dashbrd(data_dict)
 
     def update_datadog(self):
         """
@@ -359,6 +701,17 @@ def cmd_line(argv):
         help='Specify an id of an object to retrieve.  [INTEGER]')
     get_parent_parser.add_argument('-r', '--regex',
         help='Regex string to use when selecting events.')
+    get_parent_parser.add_argument('--format', choices=FORMATS,
+        default='json', help='Output format.  [DEFAULT: json]')
+    get_parent_parser.add_argument('--compress', choices=COMPRESSIONS,
+        default='none', help='Output compression.  [DEFAULT: none]')
+
+    put_parent_parser = argparse.ArgumentParser(add_help=False)
+    put_parent_parser.add_argument('--format', choices=FORMATS, default=None,
+        help='Input format.  Detected from the file if not given.')
+    put_parent_parser.add_argument('--compress', choices=COMPRESSIONS,
+        default=None,
+        help='Input compression.  Detected from the file if not given.')
 
     # alerts
     alerts = subparsers.add_parser('alerts',
@@ -370,7 +723,7 @@ def cmd_line(argv):
             help='get alerts from datadog', parents=[get_parent_parser])
     alert_put = alert_sub.add_parser('put',
             description='Takes alerts from file argument and puts them in datadog.',
-            help='put alerts to datadog')
+            help='put alerts to datadog', parents=[put_parent_parser])
     alert_put.add_argument('from_file',
         help='Use given file to create alerts. REQUIRED')
 
@@ -382,7 +735,8 @@ def cmd_line(argv):
             description='Get dashboards from datadog.', help='Get dashboards from datadog.',
             parents=[get_parent_parser])
     dash_put = dash_sub.add_parser('put',
-            description='Put dashboards to datadog.', help='Put dashboards to datadog.')
+            description='Put dashboards to datadog.', help='Put dashboards to datadog.',
+            parents=[put_parent_parser])
     dash_put.add_argument('from_file', help='Use given file to create alerts. REQUIRED')
 
     args = parser.parse_args()